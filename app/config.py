@@ -10,5 +10,8 @@ DB_TERMINUS = os.getenv("DB_TERMINUS", "terminus")
 DB_ATMS = os.getenv("DB_ATMS", "atms")
 DB_ANALYTICS = os.getenv("DB_ANALYTICS", "analytics")
 
+# จำนวน ETL job ที่รันพร้อมกันได้ (ที่เหลือรอคิว)
+ETL_MAX_WORKERS = int(os.getenv("ETL_MAX_WORKERS", "2"))
+
 if not MONGO_URI:
     raise RuntimeError("❌ MONGO_URI is not set in .env")
